@@ -1,52 +1,201 @@
 #!/usr/bin/env python3
 import atexit
+import os
+import queue
 import signal
-import subprocess
 import sys
 import threading
 import time
 from datetime import datetime
+from multiprocessing import shared_memory
 from pathlib import Path
 
 import cv2
+import numpy as np
 from flask import Flask, Response, abort, jsonify, render_template, request, send_from_directory, url_for
 from werkzeug.utils import secure_filename
 
+try:
+    import simplejpeg
+except ImportError:  # picamera2 depends on it, so this only happens off the Pi
+    simplejpeg = None
+
 WIDTH, HEIGHT, FPS = 1280, 720, 50
 PREVIEW_WIDTH, PREVIEW_HEIGHT, PREVIEW_FPS = 640, 360, 25
-JPEG_QUALITY = 65
+PREVIEW_JPEG_QUALITY = 55
+PREVIEW_OPTIMIZE = True  # optimized Huffman tables on the OpenCV path
+PREVIEW_SIZE_LOG_EVERY = PREVIEW_FPS * 30  # log JPEG size percentiles every ~30s of preview
 MAX_CLIPS = 5
+SHM_SLOTS = 4
+PAGE_CACHE_RETRY_S = 5.0  # second fadvise on a finished clip, after writeback
+# Overlay colours as (Y, U, V), full range as JPEG expects
+REC_COLOR_YUV = (76, 85, 255)
+TEXT_COLOR_YUV = (255, 128, 128)
+
+# The camera's video colour space is limited range (Y 16-235, UV 16-240) but JPEG
+# decoders assume full range, so preview planes are stretched before encoding
+_LUMA_TO_FULL = np.clip((np.arange(256) - 16) * 255 / 219, 0, 255).round().astype(np.uint8)
+_CHROMA_TO_FULL = np.clip((np.arange(256) - 128) * 255 / 224 + 128, 0, 255).round().astype(np.uint8)
+
+_MJPEG_HDR = b"--frame\r\nContent-Type: image/jpeg\r\n\r\n"
+_MJPEG_TAIL = b"\r\n"
 
 
 def log(msg: str) -> None:
     print(msg, file=sys.stderr, flush=True)
 
 
+def _clip_entry(name: str, stat: os.stat_result) -> dict:
+    return {
+        "name": name,
+        "size_bytes": stat.st_size,
+        "modified_ts": int(stat.st_mtime),
+    }
+
+
+def _drop_page_cache(path: Path) -> None:
+    """Ask the kernel to evict a file from the page cache (best effort: clean pages only)."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _interval_to_fps(interval_ns: int) -> float:
+    return 1e9 / interval_ns if interval_ns > 0 else 0.0
+
+
+def _render_overlay(text: str, scale: float) -> np.ndarray:
+    """Render text once into a boolean mask cropped to its box (top-left at 0, 0)."""
+    (tw, th), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, 2)
+    mask = np.zeros((th + baseline + 2, tw + 2), dtype=np.uint8)
+    cv2.putText(mask, text, (1, th + 1), cv2.FONT_HERSHEY_SIMPLEX, scale, 255, 2)
+    return mask.astype(bool)
+
+
+def _i420_planes(frame: np.ndarray, width: int, height: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Y, U, V views into a mapped I420 buffer whose rows may be padded past width.
+
+    Chroma rows are half the luma stride, so each array row below the Y
+    plane holds two of them.
+    """
+    stride = frame.shape[1]
+    h, w = height, width
+    return (
+        frame[:h, :w],
+        frame[h:h + h // 4].reshape(h // 2, stride // 2)[:, :w // 2],
+        frame[h + h // 4:h + h // 2].reshape(h // 2, stride // 2)[:, :w // 2],
+    )
+
+
+def _blit_overlay(planes, mask: np.ndarray, x: int, y: int, color: tuple[int, int, int]) -> None:
+    luma, u, v = planes
+    x, y = x & ~1, y & ~1  # keep luma and chroma sample grids aligned
+    h, w = mask.shape
+    luma[y:y + h, x:x + w][mask] = color[0]
+    # Chroma planes are half resolution in both directions
+    cmask = mask[::2, ::2]
+    ch, cw = cmask.shape
+    u[y // 2:y // 2 + ch, x // 2:x // 2 + cw][cmask] = color[1]
+    v[y // 2:y // 2 + ch, x // 2:x // 2 + cw][cmask] = color[2]
+
+
+class FrameRing:
+    """Ring of recent lores frames in POSIX shared memory, for other processes.
+
+    The segment starts with little-endian uint64 fields: write count, slot
+    count, width, height, bytes per frame, then one capture timestamp
+    (monotonic ns) per slot. Slots follow at a 64-byte aligned offset, each
+    holding one planar I420 frame in the camera's limited-range video colour
+    space. The newest frame is in slot (write count - 1) % slots; readers
+    should copy it and re-check the write count to make sure they weren't
+    lapped.
+    """
+
+    def __init__(self, name: str, width: int, height: int, slots: int = SHM_SLOTS) -> None:
+        self.slots = slots
+        self._width, self._height = width, height
+        self._shape = (height * 3 // 2, width)
+        frame_bytes = self._shape[0] * width
+        header_bytes = (8 * (5 + slots) + 63) // 64 * 64
+        size = header_bytes + slots * frame_bytes
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a crashed run
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._ctrl = np.ndarray((5 + slots,), dtype="<u8", buffer=self._shm.buf)
+        self._ctrl[:5] = (0, slots, width, height, frame_bytes)
+        self._frames = np.ndarray((slots, *self._shape), dtype=np.uint8, buffer=self._shm.buf, offset=header_bytes)
+
+    def write(self, frame: np.ndarray, timestamp_ns: int) -> None:
+        count = int(self._ctrl[0])
+        slot = count % self.slots
+        planes = zip(_i420_planes(self._frames[slot], self._width, self._height),
+                     _i420_planes(frame, self._width, self._height))
+        for dst, src in planes:
+            np.copyto(dst, src)
+        self._ctrl[5 + slot] = timestamp_ns
+        # Publish last, so readers never see the count ahead of the data
+        self._ctrl[0] = count + 1
+
+    def close(self) -> None:
+        del self._ctrl, self._frames
+        self._shm.close()
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
 class CameraRecorder:
-    def __init__(self, output_dir: Path) -> None:
+    def __init__(self, output_dir: Path, shm_name: str | None = None) -> None:
         self.output_dir = output_dir
+        self.shm_name = shm_name
+        self._frame_ring = None
         self._picam = None
         self._encoder = None
         self._recording = False
         self._current_file = None
-        self._h264_path = None
-        self._last_preview_jpeg = None
-        self._next_preview_encode_at = 0.0
+        self._clip_index: list[dict] = []  # newest first, mirrors the *.mp4 files in output_dir
+        self._preview_subscribers: set[queue.Queue] = set()
+        self._sub_lock = threading.Lock()
+        self._next_preview_encode_at = 0
+        self._last_published_at = 0
+        self._last_consumed_at = 0
+        self._preview_sizes = []
+        self._preview_buf = np.empty((PREVIEW_HEIGHT, PREVIEW_WIDTH, 3), dtype=np.uint8)
+        self._rec_overlay = _render_overlay("REC", 0.8)
+        self._fps_overlays: dict[str, np.ndarray] = {}
         self._frame_count = 0
         self._last_frame_at = None
-        self._measured_fps = 0.0
+        self._frame_interval_ns = 0  # EMA of the gap between frames
         self._last_error = ""
         self._running = False
         self._thread = None
         self._lock = threading.Lock()
+        self._stop_lock = threading.Lock()  # a second stop() waits for the first to finish
 
     def _open_camera(self):
         from picamera2 import Picamera2
 
         cam = Picamera2()
         config = cam.create_video_configuration(
-            main={"size": (WIDTH, HEIGHT), "format": "RGB888"},
-            controls={"FrameRate": float(FPS)},
+            buffer_count=6,
+            main={"size": (WIDTH, HEIGHT), "format": "YUV420"},
+            lores={"size": (PREVIEW_WIDTH, PREVIEW_HEIGHT), "format": "YUV420"},
+            controls={"FrameRate": float(FPS), "NoiseReductionMode": 0},
         )
         cam.configure(config)
         cam.start()
@@ -59,26 +208,38 @@ class CameraRecorder:
             if self._running:
                 return
             self.output_dir.mkdir(parents=True, exist_ok=True)
+            self._clip_index = self._scan_clips()
+            if self.shm_name and self._frame_ring is None:
+                try:
+                    self._frame_ring = FrameRing(self.shm_name, PREVIEW_WIDTH, PREVIEW_HEIGHT)
+                    log(f"[shm] sharing lores frames at /dev/shm/{self.shm_name}")
+                except Exception as exc:
+                    log(f"[shm] disabled: {exc}")
             self._running = True
             self._thread = threading.Thread(target=self._capture_loop, daemon=True)
             self._thread.start()
 
     def stop(self) -> None:
-        self.stop_recording()
-        with self._lock:
-            self._running = False
-        if self._thread is not None:
-            self._thread.join(timeout=5.0)
-        with self._lock:
-            if self._picam is not None:
-                try:
-                    self._picam.stop()
-                    self._picam.close()
-                except Exception:
-                    pass
-                self._picam = None
+        with self._stop_lock:
+            self.stop_recording()
+            with self._lock:
+                self._running = False
+            if self._thread is not None:
+                self._thread.join(timeout=5.0)
+            with self._lock:
+                if self._picam is not None:
+                    try:
+                        self._picam.stop()
+                        self._picam.close()
+                    except Exception:
+                        pass
+                    self._picam = None
+                if self._frame_ring is not None:
+                    self._frame_ring.close()
+                    self._frame_ring = None
 
     def _capture_loop(self) -> None:
+        mapped_array = None
         while True:
             with self._lock:
                 if not self._running:
@@ -88,6 +249,8 @@ class CameraRecorder:
             if cam is None:
                 try:
                     cam = self._open_camera()
+                    # Resolved once per camera open rather than per frame
+                    from picamera2 import MappedArray as mapped_array
                     with self._lock:
                         self._picam = cam
                         self._last_error = ""
@@ -98,12 +261,12 @@ class CameraRecorder:
                     continue
 
             try:
-                frame = cam.capture_array()
+                req = cam.capture_request()
             except Exception as exc:
                 with self._lock:
                     self._last_error = f"Frame capture failed: {exc}"
                     self._last_frame_at = None
-                    self._measured_fps = 0.0
+                    self._frame_interval_ns = 0
                     if self._picam is not None:
                         try:
                             self._picam.stop()
@@ -114,50 +277,121 @@ class CameraRecorder:
                 time.sleep(1.0)
                 continue
 
-            now = time.monotonic()
-            encode_preview = False
-            with self._lock:
-                if self._last_frame_at is not None:
-                    delta = now - self._last_frame_at
-                    if delta > 0:
-                        inst = 1.0 / delta
-                        self._measured_fps = (0.9 * self._measured_fps + 0.1 * inst) if self._measured_fps > 0 else inst
-                self._last_frame_at = now
-                self._frame_count += 1
-                measured_fps = self._measured_fps
-                recording = self._recording
-                if now >= self._next_preview_encode_at:
-                    self._next_preview_encode_at = now + (1.0 / PREVIEW_FPS)
-                    encode_preview = True
-
-            if encode_preview:
-                jpeg = self._build_preview(frame, recording, measured_fps)
-                if jpeg is not None:
-                    with self._lock:
-                        self._last_preview_jpeg = jpeg
+            # Hand the buffers back to libcamera promptly so the pool never runs dry
+            try:
+                # Only this thread writes the timing state, so do the math before taking the lock
+                now = time.monotonic_ns()
+                last = self._last_frame_at
+                frame_interval_ns = self._frame_interval_ns
+                if last is not None and now > last:
+                    delta = now - last
+                    frame_interval_ns = (9 * frame_interval_ns + delta) // 10 if frame_interval_ns else delta
+                # Encode only once a client has picked up the previous frame, so the
+                # preview rate follows what the viewers actually pull (capped at PREVIEW_FPS)
+                encode_preview = (
+                    bool(self._preview_subscribers)
+                    and now >= self._next_preview_encode_at
+                    and self._last_consumed_at >= self._last_published_at
+                )
+                if encode_preview:
+                    self._next_preview_encode_at = now + 1_000_000_000 // PREVIEW_FPS
+
+                with self._lock:
+                    self._last_frame_at = now
+                    self._frame_interval_ns = frame_interval_ns
+                    self._frame_count += 1
+                    recording = self._recording
+
+                ring = self._frame_ring
+                if encode_preview or ring is not None:
+                    jpeg = None
+                    with mapped_array(req, "lores") as mapped:
+                        # Share the frame before the preview overlay is drawn onto it
+                        if ring is not None:
+                            ring.write(mapped.array, now)
+                        if encode_preview:
+                            jpeg = self._build_preview(mapped.array, recording, _interval_to_fps(frame_interval_ns))
+                    if jpeg is not None:
+                        self._publish_preview(jpeg)
+            finally:
+                req.release()
+
+    def _publish_preview(self, jpeg: bytes) -> None:
+        # A plain attribute store is atomic under the GIL
+        self._last_published_at = time.monotonic_ns()
+        # Frame the multipart part once here; every client then sends the same object in one write
+        part = _MJPEG_HDR + jpeg + _MJPEG_TAIL
+        with self._sub_lock:
+            subscribers = list(self._preview_subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(part)
+            except queue.Full:
+                # Slow client: swap its unsent frame for the newest one instead of queueing
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    q.put_nowait(part)
+                except queue.Full:
+                    pass
 
     def _build_preview(self, frame, recording: bool, fps: float) -> bytes | None:
-        if frame.shape[1] != PREVIEW_WIDTH or frame.shape[0] != PREVIEW_HEIGHT:
-            preview = cv2.resize(frame, (PREVIEW_WIDTH, PREVIEW_HEIGHT), interpolation=cv2.INTER_AREA)
-        else:
-            preview = frame.copy()
+        # The ISP already scaled lores to preview size; it arrives as planar I420.
+        # frame is the mapped lores DMA buffer; nothing else reads it, so overlays are drawn in place.
+        h, w = PREVIEW_HEIGHT, PREVIEW_WIDTH
+        planes = _i420_planes(frame, w, h)
+
+        if simplejpeg is not None:
+            # Stretch to full range before the overlay so its colours land exactly
+            cv2.LUT(frame[:h], _LUMA_TO_FULL, dst=frame[:h])
+            cv2.LUT(frame[h:h + h // 2], _CHROMA_TO_FULL, dst=frame[h:h + h // 2])
 
         if recording:
-            cv2.putText(preview, "REC", (14, 28), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2, cv2.LINE_AA)
+            _blit_overlay(planes, self._rec_overlay, 14, 10, REC_COLOR_YUV)
 
+        # FPS is shown as a whole number, so only a handful of labels ever get rendered
         fps_text = f"{fps:.0f} FPS" if fps > 0 else "-- FPS"
-        sz, _ = cv2.getTextSize(fps_text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-        cv2.putText(preview, fps_text, (preview.shape[1] - sz[0] - 14, 28),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2, cv2.LINE_AA)
-
-        ok, buf = cv2.imencode(".jpg", preview, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
-        return buf.tobytes() if ok else None
+        fps_overlay = self._fps_overlays.get(fps_text)
+        if fps_overlay is None:
+            fps_overlay = self._fps_overlays[fps_text] = _render_overlay(fps_text, 0.6)
+        _blit_overlay(planes, fps_overlay, w - fps_overlay.shape[1] - 14, 14, TEXT_COLOR_YUV)
 
-    # -- Recording (hardware H.264 → remux to MP4) --
+        if simplejpeg is not None:
+            jpeg = simplejpeg.encode_jpeg_yuv_planes(*planes, quality=PREVIEW_JPEG_QUALITY, fastdct=True)
+        else:
+            # cvtColor expects limited range itself, so the overlay is only approximate here
+            if frame.shape[1] != w:
+                # cvtColor can't skip row padding; pack the planes first
+                frame = np.concatenate([p.ravel() for p in planes]).reshape(h * 3 // 2, w)
+            preview = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420, dst=self._preview_buf)
+            params = [cv2.IMWRITE_JPEG_QUALITY, PREVIEW_JPEG_QUALITY]
+            if PREVIEW_OPTIMIZE:
+                params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+            ok, buf = cv2.imencode(".jpg", preview, params)
+            if not ok:
+                return None
+            jpeg = buf.tobytes()
+
+        self._track_preview_size(len(jpeg))
+        return jpeg
+
+    def _track_preview_size(self, size: int) -> None:
+        self._preview_sizes.append(size)
+        if len(self._preview_sizes) < PREVIEW_SIZE_LOG_EVERY:
+            return
+        sizes = sorted(self._preview_sizes)
+        self._preview_sizes.clear()
+        p50 = sizes[len(sizes) // 2]
+        p95 = sizes[int(len(sizes) * 0.95)]
+        log(f"[preview] jpeg size p50={p50} p95={p95} bytes (quality {PREVIEW_JPEG_QUALITY})")
+
+    # -- Recording (hardware H.264 → MP4 muxed on the fly by ffmpeg) --
 
     def start_recording(self, label: str) -> Path:
         from picamera2.encoders import H264Encoder
-        from picamera2.outputs import FileOutput
+        from picamera2.outputs import FfmpegOutput
 
         safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in label).strip("_") or "clip"
         ts = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -170,92 +404,122 @@ class CameraRecorder:
         if cam is None:
             raise RuntimeError("Camera not connected")
 
-        h264_path = filepath.with_suffix(".h264")
-        encoder = H264Encoder(bitrate=8_000_000)
-        encoder.output = FileOutput(str(h264_path))
+        # repeat=True re-sends SPS/PPS with every I-frame (one per second), so clips
+        # cut anywhere stay decodable without ffmpeg having to buffer headers
+        encoder = H264Encoder(bitrate=8_000_000, repeat=True, iperiod=FPS, profile="high")
+        encoder.audio = False
+        encoder.output = FfmpegOutput(str(filepath), audio=False)
         cam.start_encoder(encoder)
-        log(f"[rec] started → {h264_path}")
+        log(f"[rec] started → {filepath}")
 
         with self._lock:
             self._encoder = encoder
             self._recording = True
             self._current_file = filepath
-            self._h264_path = h264_path
         return filepath
 
     def stop_recording(self) -> Path | None:
         with self._lock:
             out = self._current_file
-            h264_path = self._h264_path
             encoder = self._encoder
             was_recording = self._recording
             self._encoder = None
             self._recording = False
             self._current_file = None
-            self._h264_path = None
 
         if not was_recording or encoder is None:
             return out
 
+        # Stopping the output waits for ffmpeg to finalize the MP4
         try:
             encoder.stop()
         except Exception as exc:
             log(f"[rec] encoder stop error: {exc}")
-
-        if h264_path and Path(h264_path).exists() and out:
-            log(f"[rec] remuxing → {out.name}")
-            try:
-                subprocess.run(
-                    ["ffmpeg", "-y", "-framerate", str(FPS),
-                     "-i", str(h264_path), "-c", "copy", str(out)],
-                    capture_output=True, timeout=30,
-                )
-                Path(h264_path).unlink(missing_ok=True)
-                log(f"[rec] done ({out.stat().st_size} bytes)")
-            except Exception as exc:
-                log(f"[rec] remux error: {exc}")
+        if out and out.exists():
+            stat = out.stat()
+            log(f"[rec] done ({stat.st_size} bytes)")
+            # Keep the Pi's small RAM for live capture rather than a clip nobody re-reads soon.
+            # ffmpeg just exited, so the tail is still dirty: DONTNEED only drops clean pages
+            # but does kick off writeback, so ask again once that has had time to finish.
+            _drop_page_cache(out)
+            timer = threading.Timer(PAGE_CACHE_RETRY_S, _drop_page_cache, args=(out,))
+            timer.daemon = True
+            timer.start()
+            with self._lock:
+                # Names only have one-second resolution, so a quick restart can reuse one
+                self._clip_index = [c for c in self._clip_index if c["name"] != out.name]
+                self._clip_index.insert(0, _clip_entry(out.name, stat))
 
         self._cleanup_old_clips()
         return out
 
+    def _scan_clips(self) -> list[dict]:
+        clips = []
+        with os.scandir(self.output_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".mp4") and entry.is_file():
+                    clips.append(_clip_entry(entry.name, entry.stat()))
+        clips.sort(key=lambda c: c["modified_ts"], reverse=True)
+        return clips
+
     def _cleanup_old_clips(self) -> None:
-        clips = sorted(self.output_dir.glob("*.mp4"), key=lambda p: p.stat().st_mtime, reverse=True)
-        for old in clips[MAX_CLIPS:]:
+        with self._lock:
+            stale = self._clip_index[MAX_CLIPS:]
+            del self._clip_index[MAX_CLIPS:]
+        for old in stale:
             try:
-                old.unlink()
-                log(f"[cleanup] deleted {old.name}")
+                (self.output_dir / old["name"]).unlink()
+                log(f"[cleanup] deleted {old['name']}")
             except Exception:
                 pass
 
     # -- Public helpers --
 
-    def get_jpeg(self) -> bytes | None:
-        with self._lock:
-            return self._last_preview_jpeg
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def subscribe_preview(self) -> queue.Queue:
+        """Register a stream client.
+
+        Each new preview lands in the returned 1-slot queue as a ready-to-send multipart part.
+        """
+        q = queue.Queue(maxsize=1)
+        with self._sub_lock:
+            self._preview_subscribers.add(q)
+        self._last_consumed_at = time.monotonic_ns()
+        return q
+
+    def unsubscribe_preview(self, q: queue.Queue) -> None:
+        with self._sub_lock:
+            self._preview_subscribers.discard(q)
+
+    def next_preview(self, q: queue.Queue, timeout: float) -> bytes | None:
+        """Wait for the next multipart part on a subscriber queue; None on timeout."""
+        try:
+            part = q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self._last_consumed_at = time.monotonic_ns()
+        return part
 
     def status(self) -> dict:
+        measured_fps = round(_interval_to_fps(self._frame_interval_ns), 1)
         with self._lock:
             return {
                 "recording": self._recording,
-                "measured_fps": round(self._measured_fps, 1),
+                "measured_fps": measured_fps,
                 "camera_connected": self._picam is not None,
                 "last_error": self._last_error,
             }
 
     def list_clips(self) -> list[dict]:
-        files = sorted(self.output_dir.glob("*.mp4"), key=lambda p: p.stat().st_mtime, reverse=True)
-        clips = []
-        for path in files[:MAX_CLIPS]:
-            stat = path.stat()
-            clips.append({
-                "name": path.name,
-                "size_bytes": stat.st_size,
-                "modified_ts": int(stat.st_mtime),
-            })
-        return clips
+        # Callers decorate the entries, so hand out copies
+        with self._lock:
+            return [dict(c) for c in self._clip_index[:MAX_CLIPS]]
 
 
-def create_app(recorder: CameraRecorder) -> Flask:
+def create_app(recorder: CameraRecorder, accel_prefix: str | None = None) -> Flask:
     app = Flask(__name__)
     app.config["MAX_CONTENT_LENGTH"] = 5 * 1024 * 1024
     logo_dir = Path(app.root_path) / "static"
@@ -268,12 +532,16 @@ def create_app(recorder: CameraRecorder) -> Flask:
     @app.get("/stream.mjpg")
     def stream():
         def generate():
-            while True:
-                frame = recorder.get_jpeg()
-                if frame is None:
-                    time.sleep(0.03)
-                    continue
-                yield b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + frame + b"\r\n"
+            frames = recorder.subscribe_preview()
+            try:
+                # End with the recorder so a graceful shutdown doesn't wait on open streams
+                while recorder.running:
+                    part = recorder.next_preview(frames, timeout=1.0)
+                    if part is None:
+                        continue
+                    yield part
+            finally:
+                recorder.unsubscribe_preview(frames)
         return Response(generate(), mimetype="multipart/x-mixed-replace; boundary=frame")
 
     @app.get("/api/status")
@@ -295,7 +563,23 @@ def create_app(recorder: CameraRecorder) -> Flask:
         clip_path = (recorder.output_dir / safe_name).resolve()
         if clip_path.parent != recorder.output_dir.resolve() or not clip_path.exists():
             abort(404)
-        return send_from_directory(recorder.output_dir.resolve(), safe_name, as_attachment=True)
+        if accel_prefix:
+            # nginx streams the file itself with sendfile(); Python never touches the bytes
+            resp = Response(mimetype="video/mp4")
+            resp.headers["X-Accel-Redirect"] = f"{accel_prefix.rstrip('/')}/{safe_name}"
+            resp.headers["Content-Disposition"] = f'attachment; filename="{safe_name}"'
+            return resp
+        # send_file hands the open file to wsgi.file_wrapper when the server offers one
+        resp = send_from_directory(recorder.output_dir.resolve(), safe_name, as_attachment=True)
+        # Passthrough bodies skip call_on_close, so hook the file wrapper's close(),
+        # which the server calls once the clip has been sent
+        body_close = getattr(resp.response, "close", None)
+        if body_close is not None:
+            def close():
+                body_close()
+                _drop_page_cache(clip_path)
+            resp.response.close = close
+        return resp
 
     @app.post("/api/start")
     def api_start():
@@ -332,9 +616,66 @@ def main() -> None:
     parser.add_argument("--host", default="0.0.0.0")
     parser.add_argument("--port", type=int, default=5000)
     parser.add_argument("--output-dir", default="recordings")
+    parser.add_argument("--x-accel-prefix", default=None,
+                        help="serve clip downloads via nginx X-Accel-Redirect under this internal location")
+    parser.add_argument("--shm-name", default=None,
+                        help="share lores frames with other processes in this /dev/shm segment")
     args = parser.parse_args()
 
-    recorder = CameraRecorder(output_dir=Path(args.output_dir))
+    try:
+        import gevent  # noqa: F401
+        import gunicorn  # noqa: F401
+    except ImportError:
+        log("[server] gunicorn/gevent not installed, using the Flask dev server")
+        _serve_dev(args)
+    else:
+        _serve_gunicorn(args)
+
+
+def _serve_gunicorn(args) -> None:
+    import gevent
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        recorder = None
+
+        def load_config(self):
+            self.cfg.set("bind", f"{args.host}:{args.port}")
+            # One process owns the camera; gevent multiplexes the long-lived MJPEG streams
+            self.cfg.set("workers", 1)
+            self.cfg.set("worker_class", "gevent")
+            self.cfg.set("graceful_timeout", 5)
+            self.cfg.set("post_worker_init", self._stop_recorder_on_exit)
+            self.cfg.set("worker_exit", lambda server, worker: self.recorder and self.recorder.stop())
+
+        def _stop_recorder_on_exit(self, worker):
+            # worker_exit only fires after the connection drain, which the arbiter may cut
+            # short with SIGKILL; finish the clip first. gunicorn bound its handlers in
+            # init_signals, so they have to be re-registered rather than patched.
+            def stop_first(handler):
+                def finish(sig, frame):
+                    self.recorder.stop()
+                    handler(sig, frame)
+
+                # Signal handlers must not block the hub
+                return lambda sig, frame: gevent.spawn(finish, sig, frame)
+
+            signal.signal(signal.SIGTERM, stop_first(worker.handle_exit))
+            signal.signal(signal.SIGQUIT, stop_first(worker.handle_quit))
+            signal.signal(signal.SIGINT, stop_first(worker.handle_quit))
+
+        def load(self):
+            # Runs in the worker after gevent has patched threading, so the
+            # recorder's locks and capture thread cooperate with the streams
+            self.recorder = CameraRecorder(output_dir=Path(args.output_dir), shm_name=args.shm_name)
+            self.recorder.start()
+            return create_app(self.recorder, accel_prefix=args.x_accel_prefix)
+
+    Server().run()
+
+
+def _serve_dev(args) -> None:
+    recorder = CameraRecorder(output_dir=Path(args.output_dir), shm_name=args.shm_name)
     recorder.start()
 
     def shutdown(*_):
@@ -345,7 +686,7 @@ def main() -> None:
     signal.signal(signal.SIGINT, shutdown)
     signal.signal(signal.SIGTERM, shutdown)
 
-    app = create_app(recorder)
+    app = create_app(recorder, accel_prefix=args.x_accel_prefix)
     app.run(host=args.host, port=args.port, threaded=True)
 
 